@@ -2,9 +2,12 @@ import streamlit as st
 import os
 from modules.markdown_loader import load_markdown
 from modules.text_splitter import split_text
-from modules.embedder import get_embedding, initialize_openai
+from modules.embedder import get_embedding, get_embeddings, initialize_openai
 from modules.retriever import retrieve
 from modules.qa_chain_new import generate_answer
+from modules.hierarchical_index import build_section_chunks, format_section_path, HierarchicalIndex
+from modules.chat_session import ChatSession
+from modules.deduplicator import deduplicate_chunks
 
 # 页面配置
 st.set_page_config(
@@ -16,6 +19,8 @@ st.set_page_config(
 # 初始化会话状态
 if 'chunks' not in st.session_state:
     st.session_state.chunks = []
+if 'chunk_records' not in st.session_state:
+    st.session_state.chunk_records = []
 if 'embeddings' not in st.session_state:
     st.session_state.embeddings = []
 if 'file_processed' not in st.session_state:
@@ -24,6 +29,12 @@ if 'openai_key' not in st.session_state:
     st.session_state.openai_key = ""
 if 'api_base' not in st.session_state:
     st.session_state.api_base = ""
+if 'hier_index' not in st.session_state:
+    st.session_state.hier_index = None
+if 'chat_session' not in st.session_state:
+    st.session_state.chat_session = None
+if 'chat_messages' not in st.session_state:
+    st.session_state.chat_messages = []
 
 # 标题
 st.title("📚 个人知识库助手")
@@ -58,7 +69,15 @@ with st.sidebar:
                             help="相邻文本块的重叠字符数")
     top_k = st.slider("检索数量", min_value=1, max_value=10, value=3, step=1,
                     help="每次问答检索的相关文本块数量")
-    
+    hierarchical = st.checkbox("按标题分层检索", value=False,
+                               help="按Markdown标题切分章节，先挑选相关章节，再在章节内检索文本块（需在上传文件前设置）")
+    top_sections = st.slider("候选章节数量", min_value=1, max_value=20, value=5, step=1,
+                           help="分层检索第一阶段保留的章节数量", disabled=not hierarchical)
+    dedup = st.checkbox("合并重复文本块", value=True,
+                        help="向量化前合并完全相同或高度相似的文本块（如复制的模板），每组只向量化一次")
+    chat_mode = st.checkbox("多轮对话模式", value=False,
+                            help="保留对话上下文，追问会结合历史改写后再检索；较早的对话会被自动摘要")
+
     st.markdown("---")
     st.markdown("### 关于")
     st.info("这是一个基于OpenAI API的个人知识库助手，将您的Markdown笔记转化为可查询的知识库。")
@@ -73,22 +92,125 @@ if uploaded_file and not st.session_state.file_processed:
         # 读取并解析Markdown文件
         content = load_markdown(uploaded_file)
         
-        # 文本切分
-        chunks = split_text(content, chunk_size=chunk_size, overlap=chunk_overlap)
+        # 文本切分：分层检索时按章节切分，文本块不跨越章节
+        if hierarchical:
+            chunk_records = build_section_chunks(content, uploaded_file.name, chunk_size=chunk_size, overlap=chunk_overlap)
+        else:
+            chunk_records = [
+                {"text": chunk, "file": uploaded_file.name}
+                for chunk in split_text(content, chunk_size=chunk_size, overlap=chunk_overlap)
+            ]
+        total_chunks = len(chunk_records)
+        
+        # 去重：重复的文本块只保留一个代表参与向量化和检索
+        if dedup:
+            chunk_records = deduplicate_chunks(chunk_records)
+        chunks = [record["text"] for record in chunk_records]
         st.session_state.chunks = chunks
+        st.session_state.chunk_records = chunk_records
         
         if st.session_state.openai_key:
             # 计算Embedding
             with st.status("生成文本向量中，请稍候..."):
-                embeddings = [get_embedding(chunk) for chunk in chunks]
-                st.session_state.embeddings = embeddings
-                st.session_state.file_processed = True
-                st.success(f"文件处理完成，共切分为{len(chunks)}个文本块")
+                try:
+                    embeddings = get_embeddings(chunks)
+                except Exception as e:
+                    embeddings = None
+                    st.error(f"生成文本向量失败，请稍后重试: {str(e)}")
+                if embeddings is not None:
+                    st.session_state.embeddings = embeddings
+                    if hierarchical:
+                        st.session_state.hier_index = HierarchicalIndex(chunk_records, embeddings)
+                    st.session_state.file_processed = True
+                    if len(chunks) < total_chunks:
+                        st.success(f"文件处理完成，共切分为{total_chunks}个文本块，合并重复后{len(chunks)}个")
+                    else:
+                        st.success(f"文件处理完成，共切分为{len(chunks)}个文本块")
         else:
             st.warning("请先设置OpenAI API Key")
 
+def describe_chunk(record):
+    """
+    生成文本块的出处说明：所属章节，以及被合并的重复内容数量
+    """
+    parts = []
+    if "section_path" in record:
+        parts.append(f"章节：{format_section_path(record['section_path'])}")
+    if record.get("duplicates"):
+        parts.append(f"另有{len(record['duplicates'])}处相同或相似内容")
+    return "；".join(parts)
+
+def retrieve_chunks(question_embedding):
+    """
+    根据当前知识库检索相关文本块，返回文本块列表和对应的出处说明
+    """
+    if st.session_state.hier_index is not None:
+        hits = st.session_state.hier_index.search(question_embedding, top_k=top_k, top_sections=top_sections)
+        relevant_indices = [hit["index"] for hit in hits]
+    else:
+        relevant_indices = retrieve(question_embedding, st.session_state.embeddings, top_k=top_k)
+    records = [st.session_state.chunk_records[i] for i in relevant_indices]
+    return [record["text"] for record in records], [describe_chunk(record) for record in records]
+
+def show_chunks(relevant_chunks, captions=None):
+    """
+    在可折叠区域中展示相关文本块
+    """
+    with st.expander("查看相关文本块"):
+        for i, chunk in enumerate(relevant_chunks):
+            st.markdown(f"**文本块 {i+1}**")
+            if captions and captions[i]:
+                st.caption(captions[i])
+            st.info(chunk)
+
 # 如果文件已处理，显示问答界面
-if st.session_state.file_processed:
+if st.session_state.file_processed and chat_mode:
+    st.markdown("---")
+    st.subheader("💬 与您的知识库对话")
+    
+    if st.session_state.chat_session is None:
+        st.session_state.chat_session = ChatSession(st.session_state.get("openai_client"))
+    # API配置可能在对话过程中被修改，始终使用最新的客户端
+    st.session_state.chat_session.client = st.session_state.get("openai_client")
+    
+    if st.button("清空对话"):
+        st.session_state.chat_session.reset()
+        st.session_state.chat_messages = []
+    
+    # 显示完整的对话记录（模型实际使用的历史由ChatSession按预算截断和摘要）
+    for message in st.session_state.chat_messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+            if message.get("chunks"):
+                show_chunks(message["chunks"])
+    
+    question = st.chat_input("输入您的问题")
+    
+    if question:
+        if len(st.session_state.chunks) > 0 and len(st.session_state.embeddings) > 0:
+            with st.chat_message("user"):
+                st.markdown(question)
+            
+            with st.chat_message("assistant"):
+                with st.spinner("思考中..."):
+                    result = st.session_state.chat_session.ask(
+                        question, lambda embedding: retrieve_chunks(embedding)[0]
+                    )
+                st.markdown(result["answer"])
+                if result["standalone_question"] != question:
+                    st.caption(f"检索问题：{result['standalone_question']}")
+                if result["reused_context"]:
+                    st.caption("话题未变化，复用了上一轮的检索结果")
+                show_chunks(result["chunks"])
+            
+            st.session_state.chat_messages.append({"role": "user", "content": question})
+            st.session_state.chat_messages.append(
+                {"role": "assistant", "content": result["answer"], "chunks": result["chunks"]}
+            )
+        else:
+            st.error("知识库中没有内容，请上传并处理Markdown文件")
+
+elif st.session_state.file_processed:
     st.markdown("---")
     st.subheader("💬 向您的知识库提问")
     
@@ -102,8 +224,7 @@ if st.session_state.file_processed:
                 question_embedding = get_embedding(question)
                 
                 # 检索相关文本块
-                relevant_indices = retrieve(question_embedding, st.session_state.embeddings, top_k=top_k)
-                relevant_chunks = [st.session_state.chunks[i] for i in relevant_indices]
+                relevant_chunks, captions = retrieve_chunks(question_embedding)
                 
                 # 生成答案
                 answer = generate_answer(question, relevant_chunks)
@@ -113,9 +234,6 @@ if st.session_state.file_processed:
                 st.markdown(answer)
                 
                 # 显示相关内容（可折叠）
-                with st.expander("查看相关文本块"):
-                    for i, chunk in enumerate(relevant_chunks):
-                        st.markdown(f"**文本块 {i+1}**")
-                        st.info(chunk)
+                show_chunks(relevant_chunks, captions)
         else:
             st.error("知识库中没有内容，请上传并处理Markdown文件")
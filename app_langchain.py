@@ -9,6 +9,7 @@ from modules.langchain_helper import (
     create_qa_chain,
     query_knowledge_base
 )
+from modules.deduplicator import deduplicate_documents
 
 # 页面配置
 st.set_page_config(
@@ -62,6 +63,8 @@ with st.sidebar:
                             help="相邻文本块的重叠字符数")
     top_k = st.slider("检索数量", min_value=1, max_value=10, value=3, step=1,
                     help="每次问答检索的相关文本块数量")
+    dedup = st.checkbox("合并重复文本块", value=True,
+                        help="向量化前合并完全相同或高度相似的文本块（如复制的模板），每组只向量化一次")
     
     st.markdown("---")
     st.markdown("### 关于")
@@ -83,6 +86,10 @@ if uploaded_file and not st.session_state.file_processed:
                 # 文本切分
                 with st.status("切分文档..."):
                     chunks = split_documents(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+                    total_chunks = len(chunks)
+                    # 去重：重复的文本块只保留一个代表参与向量化和索引
+                    if dedup:
+                        chunks = deduplicate_documents(chunks)
                     st.session_state.doc_chunks = chunks
                 
                 # 创建嵌入模型
@@ -106,12 +113,15 @@ if uploaded_file and not st.session_state.file_processed:
                 
                 # 创建问答链
                 with st.status("构建问答链..."):
-                    qa_chain = create_qa_chain(llm, vectorstore)
+                    qa_chain = create_qa_chain(llm, vectorstore, top_k=top_k)
                     st.session_state.qa_chain = qa_chain
                 
                 # 更新状态
                 st.session_state.file_processed = True
-                st.success(f"文件处理完成，共切分为{len(chunks)}个文本块")
+                if len(chunks) < total_chunks:
+                    st.success(f"文件处理完成，共切分为{total_chunks}个文本块，合并重复后{len(chunks)}个")
+                else:
+                    st.success(f"文件处理完成，共切分为{len(chunks)}个文本块")
                 
             except Exception as e:
                 st.error(f"处理文件时出错: {str(e)}")
@@ -145,6 +155,8 @@ if st.session_state.file_processed and st.session_state.qa_chain:
                     for i, doc in enumerate(source_docs):
                         st.markdown(f"**文本块 {i+1}**")
                         st.info(doc.page_content)
+                        if doc.metadata.get("duplicates"):
+                            st.caption(f"另有{len(doc.metadata['duplicates'])}处相同或相似内容")
                         st.caption(f"相关度：{i+1}/{len(source_docs)}")
                         
             except Exception as e:
@@ -0,0 +1,109 @@
+import argparse
+import os
+import sys
+from dotenv import load_dotenv
+from modules.batch_qa import run_simple_batch, run_langchain_batch
+from modules.sharded_index import parse_address, read_manifest
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="批量问答：读取JSONL问题文件，基于Markdown知识库并发生成回答，结果以JSONL流式输出"
+    )
+    parser.add_argument("questions", help="JSONL问题文件，每行为 {\"id\": ..., \"question\": ...} 或纯字符串")
+    parser.add_argument("--docs", nargs="+", default=[], help="Markdown文件或目录（目录会递归查找.md文件）")
+    parser.add_argument("-o", "--output", default="-", help="结果输出的JSONL文件，默认输出到标准输出")
+    parser.add_argument("--mode", choices=["simple", "langchain"], default="simple",
+                        help="simple: 原始流程（app.py）；langchain: LangChain + FAISS 问答链（app_langchain.py）")
+    parser.add_argument("--top-k", type=int, default=3, help="每个问题检索的文本块数量")
+    parser.add_argument("--chunk-size", type=int, default=500, help="文本块大小")
+    parser.add_argument("--chunk-overlap", type=int, default=50, help="文本块重叠度")
+    parser.add_argument("--workers", type=int, default=8, help="并发生成回答的线程数")
+    parser.add_argument("--batch-size", type=int, default=64, help="每批向量化的文本数量")
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="按Markdown标题分层检索（仅simple模式）：先选章节，再在章节内检索文本块")
+    parser.add_argument("--top-sections", type=int, default=5, help="分层检索保留的候选章节数量")
+    parser.add_argument("--top-docs", type=int, default=None, help="分层检索先保留的候选文件数量，默认按文件数量自动选择，0表示不按文件筛选")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="分片数量（仅simple模式）：按文件划分文本块，每个分片由独立进程并行检索")
+    parser.add_argument("--index-dir", default=None,
+                        help="分片索引目录，目录中已有索引时直接复用（文档变更后请用 shard_index.py 重建）")
+    parser.add_argument("--shard-servers", nargs="+", default=None, metavar="HOST:PORT",
+                        help="连接已由 shard_index.py serve 启动的分片服务，此时无需 --docs")
+    parser.add_argument("--authkey", default=os.getenv("MD_HELPER_SHARD_AUTHKEY"),
+                        help="分片服务认证密钥（使用 --shard-servers 时必填），默认读取MD_HELPER_SHARD_AUTHKEY")
+    parser.add_argument("--no-dedup", action="store_true", help="不合并重复文本块（默认在向量化前合并）")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8, help="近似重复的Jaccard相似度阈值")
+    parser.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY"), help="OpenAI API Key，默认读取OPENAI_API_KEY")
+    parser.add_argument("--api-base", default=os.getenv("OPENAI_API_BASE"), help="自定义API地址，默认读取OPENAI_API_BASE")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    load_dotenv()
+    args = parse_args(argv)
+
+    if not args.api_key:
+        print("请通过 --api-key 或环境变量 OPENAI_API_KEY 提供API Key", file=sys.stderr)
+        return 1
+
+    sharded = bool(args.shards or args.index_dir or args.shard_servers)
+    if args.shard_servers and not args.authkey:
+        print("请通过 --authkey 或环境变量 MD_HELPER_SHARD_AUTHKEY 提供分片服务认证密钥", file=sys.stderr)
+        return 1
+    if not args.docs and not args.shard_servers and not (args.index_dir and read_manifest(args.index_dir)):
+        print("请通过 --docs 提供Markdown文件或目录", file=sys.stderr)
+        return 1
+
+    if args.mode == "langchain":
+        if args.hierarchical or sharded:
+            print("--hierarchical 和分片参数仅支持 simple 模式", file=sys.stderr)
+            return 1
+        run, extra = run_langchain_batch, {"dedup": not args.no_dedup, "dedup_threshold": args.dedup_threshold}
+    else:
+        if args.hierarchical and sharded:
+            print("--hierarchical 不能与分片参数同时使用", file=sys.stderr)
+            return 1
+        run = run_simple_batch
+        extra = {
+            "hierarchical": args.hierarchical,
+            "top_sections": args.top_sections,
+            "top_docs": args.top_docs,
+            "num_shards": args.shards,
+            "index_dir": args.index_dir,
+            "shard_servers": [parse_address(address) for address in args.shard_servers or []],
+            "authkey": args.authkey.encode('utf-8') if args.authkey else None,
+            "dedup": not args.no_dedup,
+            "dedup_threshold": args.dedup_threshold
+        }
+
+    output = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+
+    try:
+        summary = run(
+            args.questions,
+            args.docs,
+            output,
+            api_key=args.api_key,
+            api_base=args.api_base,
+            top_k=args.top_k,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            **extra
+        )
+    except Exception as e:
+        print(f"批量问答失败: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(
+        f"完成 {summary['questions']} 个问题（失败 {summary['errors']} 个），"
+        f"耗时 {summary['elapsed_s']} 秒，共消耗 {summary['total_tokens']} tokens",
+        file=sys.stderr
+    )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
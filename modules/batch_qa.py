@@ -0,0 +1,438 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Iterable, TextIO, Optional, Callable, Tuple
+
+# 输出记录中由批量问答生成的字段；输入中的同名字段（以及input本身）移到input字段下保留
+OUTPUT_FIELDS = ("answer", "sources", "usage", "error", "retrieval_ms", "generation_ms", "latency_ms")
+
+def collect_markdown_files(paths: List[str]) -> List[str]:
+    """
+    展开输入路径，目录会被递归查找其中的Markdown文件
+
+    Args:
+        paths: 文件或目录路径列表
+
+    Returns:
+        List[str]: 排序后的Markdown文件路径列表
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.endswith(".md"))
+        else:
+            files.append(path)
+
+    return sorted(files)
+
+def read_questions(path: str) -> Iterator[Tuple[Dict[str, Any], Optional[str]]]:
+    """
+    逐行读取JSONL问题文件
+
+    每行可以是 {"id": ..., "question": ...} 对象，也可以是纯字符串；
+    缺少id时使用行号作为id，其余字段原样保留到输出中；与生成字段（OUTPUT_FIELDS）
+    同名的字段（如预期答案answer）会放在输出的input字段下，不会被覆盖。
+    格式错误的行不会中断读取，而是连同错误信息一起返回，由调用方写出错误记录。
+
+    Args:
+        path: JSONL文件路径
+
+    Yields:
+        Tuple: (问题记录, 错误信息)，正常的行错误信息为None，记录至少包含id和question；
+            格式错误的行记录只包含id
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield {"id": line_no}, f"第{line_no}行不是合法的JSON: {str(e)}"
+                continue
+            if isinstance(record, str):
+                record = {"question": record}
+            if not isinstance(record, dict):
+                yield {"id": line_no}, f"第{line_no}行应为JSON对象或字符串"
+                continue
+            record.setdefault("id", line_no)
+            if not isinstance(record.get("question"), str) or not record["question"].strip():
+                yield record, f"第{line_no}行缺少question字段"
+                continue
+            yield record, None
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """
+    将可迭代对象按固定大小分批，不会一次性读入全部数据
+
+    Args:
+        items: 任意可迭代对象
+        batch_size: 每批的数量
+
+    Yields:
+        List: 一批元素
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class JsonlWriter:
+    """
+    线程安全的JSONL写入器，每条结果写入后立即刷新，便于流式查看进度
+    """
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+            self.count += 1
+
+def _run_pipeline(questions_path: str, writer: JsonlWriter,
+                  embed_batch: Callable[[List[str]], List[Any]],
+                  answer_one: Callable[[Dict[str, Any], Any], Dict[str, Any]],
+                  workers: int, batch_size: int) -> Dict[str, Any]:
+    """
+    批量问答的公共调度流程
+
+    问题按batch_size分批读取，每批先统一向量化和检索，再交给有界线程池并发生成回答；
+    同时在途的问题数不超过workers的两倍，避免大文件一次性占满内存。
+
+    Args:
+        questions_path: JSONL问题文件路径
+        writer: 结果写入器
+        embed_batch: 对一批问题文本做向量化与检索，返回与输入等长的检索结果列表
+        answer_one: 根据单个问题记录与其检索结果生成一条输出记录
+        workers: 并发线程数
+        batch_size: 每批问题数量
+
+    Returns:
+        Dict: 运行汇总信息
+    """
+    in_flight = threading.BoundedSemaphore(max(1, workers) * 2)
+    totals = {"questions": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    totals_lock = threading.Lock()
+    started = time.perf_counter()
+
+    def finish(record: Dict[str, Any], result: Dict[str, Any], retrieval_ms: float, generation_ms: float) -> None:
+        output = _input_fields(record)
+        output.update(result)
+        output["retrieval_ms"] = round(retrieval_ms, 2)
+        output["generation_ms"] = round(generation_ms, 2)
+        output["latency_ms"] = round(retrieval_ms + generation_ms, 2)
+        writer.write(output)
+
+        with totals_lock:
+            totals["questions"] += 1
+            if output.get("error"):
+                totals["errors"] += 1
+            usage = output.get("usage") or {}
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                totals[key] += usage.get(key) or 0
+
+    def task(record: Dict[str, Any], retrieved: Any, retrieval_ms: float) -> None:
+        try:
+            gen_started = time.perf_counter()
+            try:
+                result = answer_one(record, retrieved)
+            except Exception as e:
+                result = _error_result(e)
+            finish(record, result, retrieval_ms, (time.perf_counter() - gen_started) * 1000)
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for batch in iter_batches(read_questions(questions_path), batch_size):
+            # 格式错误的行直接写出错误记录，不参与检索
+            for record, error in batch:
+                if error is not None:
+                    finish(record, _error_result(error), 0.0, 0.0)
+            records = [record for record, error in batch if error is None]
+            if not records:
+                continue
+
+            batch_started = time.perf_counter()
+            try:
+                retrieved_list = embed_batch([record["question"] for record in records])
+            except Exception as e:
+                # 本批向量化或检索失败时，本批问题记为失败，继续处理后续批次
+                retrieval_ms = (time.perf_counter() - batch_started) * 1000 / len(records)
+                for record in records:
+                    finish(record, _error_result(e), retrieval_ms, 0.0)
+                continue
+            # 批量向量化与检索的耗时平摊到本批每个问题上
+            retrieval_ms = (time.perf_counter() - batch_started) * 1000 / len(records)
+
+            for record, retrieved in zip(records, retrieved_list):
+                in_flight.acquire()
+                executor.submit(task, record, retrieved, retrieval_ms)
+
+    totals["elapsed_s"] = round(time.perf_counter() - started, 2)
+    return totals
+
+def _input_fields(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    保留输入记录的字段，与生成字段同名的移到input下
+    """
+    output = {}
+    clashes = {}
+    for key, value in record.items():
+        if key in OUTPUT_FIELDS or key == "input":
+            clashes[key] = value
+        else:
+            output[key] = value
+    if clashes:
+        output["input"] = clashes
+    return output
+
+def _error_result(error: Any) -> Dict[str, Any]:
+    """
+    生成失败问题的输出字段
+    """
+    return {"answer": None, "sources": [], "usage": None, "error": str(error)}
+
+def _to_source(hit: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    将检索命中结果转换为输出中的来源记录
+    """
+    source = {"file": hit["file"], "content": hit["text"]}
+    if "index" in hit:
+        source["chunk"] = hit["index"]
+    for key in ("section_path", "score", "shard", "duplicates"):
+        if key in hit:
+            source[key] = hit[key]
+    return source
+
+def _document_source(doc: Any) -> Dict[str, Any]:
+    """
+    将LangChain文档块转换为输出中的来源记录
+    """
+    source = {"file": doc.metadata.get("source"), "content": doc.page_content}
+    if doc.metadata.get("duplicates"):
+        source["duplicates"] = [
+            {"file": duplicate.get("source"), "position": duplicate["position"]}
+            for duplicate in doc.metadata["duplicates"]
+        ]
+    return source
+
+def run_simple_batch(questions_path: str, doc_paths: List[str], output: TextIO,
+                     api_key: str, api_base: Optional[str] = None, top_k: int = 3,
+                     chunk_size: int = 500, chunk_overlap: int = 50,
+                     workers: int = 8, batch_size: int = 64, hierarchical: bool = False,
+                     top_sections: int = 5, top_docs: Optional[int] = None,
+                     num_shards: int = 0, index_dir: Optional[str] = None,
+                     shard_servers: Optional[List[Tuple[str, int]]] = None,
+                     authkey: Optional[bytes] = None, dedup: bool = True,
+                     dedup_threshold: float = 0.8) -> Dict[str, Any]:
+    """
+    使用原始流程（get_embedding → retrieve → generate_answer）批量回答问题
+
+    Args:
+        questions_path: JSONL问题文件路径
+        doc_paths: Markdown文件或目录列表
+        output: 结果输出流
+        api_key: OpenAI API密钥
+        api_base: 可选的自定义API地址
+        top_k: 每个问题检索的文本块数量
+        chunk_size: 文本块大小
+        chunk_overlap: 文本块重叠度
+        workers: 并发生成回答的线程数
+        batch_size: 每批向量化的问题数量
+        hierarchical: 是否使用按标题分层的两阶段检索
+        top_sections: 分层检索时保留的候选章节数量
+        top_docs: 分层检索时先保留的候选文件数量，为None时按文件数量自动选择，为0时不按文件筛选
+        num_shards: 分片数量，大于0时使用每分片一个进程的分片索引
+        index_dir: 分片索引目录，已存在索引时直接复用，不再重新向量化文档
+        shard_servers: 已启动的分片服务地址列表，提供时不再加载本地文档
+        authkey: 连接分片服务的认证密钥
+        dedup: 是否在向量化前合并重复文本块
+        dedup_threshold: 近似重复的Jaccard相似度阈值
+
+    Returns:
+        Dict: 运行汇总信息
+    """
+    from modules import embedder
+    from modules.markdown_loader import load_markdown
+    from modules.text_splitter import split_text
+    from modules.retriever import normalize_embeddings, retrieve_batch
+    from modules.qa_chain_new import generate_answer_with_usage
+    from modules.hierarchical_index import build_section_chunks, HierarchicalIndex
+    from modules.sharded_index import (
+        ShardedIndex, build_sharded_index, normalize_source, read_manifest, shard_for, source_root
+    )
+    from modules.deduplicator import deduplicate_chunks
+
+    embedder.initialize_openai(api_key, api_base)
+    client = embedder.openai_client
+    sharded = bool(num_shards or index_dir or shard_servers)
+
+    def build_chunks(num_shards: Optional[int] = None,
+                     root: Optional[str] = None) -> Tuple[List[Dict[str, Any]], List[List[float]]]:
+        # 构建知识库：记录每个文本块所属的文件（分层检索时还记录标题路径）；
+        # 分片索引中的文件路径规范化为相对root的路径，保证同一文件总落在同一分片
+        chunk_records = []
+        for path in collect_markdown_files(doc_paths):
+            content = load_markdown(path)
+            source = normalize_source(path, root) if num_shards else path
+            if hierarchical:
+                chunk_records.extend(build_section_chunks(content, source, chunk_size=chunk_size, overlap=chunk_overlap))
+            else:
+                chunk_records.extend(
+                    {"text": chunk, "file": source}
+                    for chunk in split_text(content, chunk_size=chunk_size, overlap=chunk_overlap)
+                )
+        # 重复的文本块只向量化代表，出处记录在代表的duplicates字段中；
+        # 分片索引只在分片内部去重，保证各分片可以单独重建
+        if dedup:
+            partition = (lambda chunk: shard_for(chunk["file"], num_shards)) if num_shards else None
+            chunk_records = deduplicate_chunks(chunk_records, threshold=dedup_threshold, partition=partition)
+        chunks = [record["text"] for record in chunk_records]
+        return chunk_records, embedder.get_embeddings(chunks, batch_size=batch_size)
+
+    def embed_questions(questions: List[str]) -> List[List[float]]:
+        return embedder.get_embeddings(questions, batch_size=batch_size)
+
+    temp_dir = None
+    sharded_index = None
+    if shard_servers:
+        sharded_index = ShardedIndex.connect(shard_servers, authkey)
+    elif sharded:
+        if index_dir is None:
+            temp_dir = tempfile.TemporaryDirectory()
+            index_dir = temp_dir.name
+        if read_manifest(index_dir) is None:
+            num_shards = num_shards or 4
+            root = source_root(doc_paths)
+            chunk_records, chunk_embeddings = build_chunks(num_shards, root)
+            build_sharded_index(index_dir, chunk_records, chunk_embeddings, num_shards=num_shards, root=root)
+        sharded_index = ShardedIndex.from_directory(index_dir)
+
+    if sharded_index is not None:
+        def embed_batch(questions: List[str]) -> List[List[Dict[str, Any]]]:
+            return sharded_index.search_batch(embed_questions(questions), top_k=top_k)
+    elif hierarchical:
+        index = HierarchicalIndex(*build_chunks())
+
+        def embed_batch(questions: List[str]) -> List[List[Dict[str, Any]]]:
+            return index.search_batch(
+                embed_questions(questions), top_k=top_k, top_sections=top_sections, top_docs=top_docs
+            )
+    else:
+        chunk_records, chunk_embeddings = build_chunks()
+        # 文档向量只归一化一次，之后每批查询只做一次矩阵乘法
+        doc_matrix = normalize_embeddings(chunk_embeddings)
+
+        def embed_batch(questions: List[str]) -> List[List[Dict[str, Any]]]:
+            return [
+                [dict(chunk_records[i], index=i) for i in indices]
+                for indices in retrieve_batch(embed_questions(questions), doc_matrix, top_k=top_k, normalized=True)
+            ]
+
+    def answer_one(record: Dict[str, Any], hits: List[Dict[str, Any]]) -> Dict[str, Any]:
+        result = generate_answer_with_usage(record["question"], [hit["text"] for hit in hits], client=client)
+        result["sources"] = [_to_source(hit) for hit in hits]
+        return result
+
+    try:
+        return _run_pipeline(questions_path, JsonlWriter(output), embed_batch, answer_one, workers, batch_size)
+    finally:
+        if sharded_index is not None:
+            sharded_index.close()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+def run_langchain_batch(questions_path: str, doc_paths: List[str], output: TextIO,
+                        api_key: str, api_base: Optional[str] = None, top_k: int = 3,
+                        chunk_size: int = 500, chunk_overlap: int = 50,
+                        workers: int = 8, batch_size: int = 64, dedup: bool = True,
+                        dedup_threshold: float = 0.8) -> Dict[str, Any]:
+    """
+    使用LangChain + FAISS问答链批量回答问题
+
+    问题向量按批计算后直接在FAISS中检索，再把检索结果交给问答链生成回答，
+    避免问答链内部对每个问题单独调用一次embedding接口。
+
+    Args:
+        参数含义同run_simple_batch
+
+    Returns:
+        Dict: 运行汇总信息
+    """
+    import numpy as np
+    from langchain.callbacks import get_openai_callback
+    from modules.langchain_helper import (
+        load_markdown_with_langchain,
+        split_documents,
+        get_openai_embeddings,
+        create_faiss_index,
+        get_chat_model,
+        create_qa_chain,
+        answer_with_documents
+    )
+    from modules.deduplicator import deduplicate_documents
+    from modules.retriever import normalize_embeddings
+
+    documents = []
+    for path in collect_markdown_files(doc_paths):
+        with open(path, 'rb') as f:
+            file_documents = load_markdown_with_langchain(io.BytesIO(f.read()))
+        # 加载器记录的是临时文件路径，这里改回原始文件路径
+        for document in file_documents:
+            document.metadata["source"] = path
+        documents.extend(file_documents)
+
+    chunks = split_documents(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if dedup:
+        chunks = deduplicate_documents(chunks, threshold=dedup_threshold)
+    embeddings = get_openai_embeddings(api_key=api_key, api_base=api_base)
+    vectorstore = create_faiss_index(chunks, embeddings)
+    llm = get_chat_model(api_key=api_key, api_base=api_base)
+    qa_chain = create_qa_chain(llm, vectorstore, top_k=top_k)
+
+    def embed_batch(questions: List[str]) -> List[List[Any]]:
+        # 整批问题只做一次FAISS检索，再按index_to_docstore_id映射回文档块
+        queries = np.array(embeddings.embed_documents(questions), dtype=np.float32)
+        if getattr(vectorstore, "_normalize_L2", False):
+            queries = normalize_embeddings(queries)
+        _, indices = vectorstore.index.search(queries, top_k)
+        return [
+            [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in row if i != -1]
+            for row in indices
+        ]
+
+    def answer_one(record: Dict[str, Any], source_documents: List[Any]) -> Dict[str, Any]:
+        # 回调基于contextvars，在各自的工作线程内统计，互不干扰
+        with get_openai_callback() as cb:
+            result = answer_with_documents(record["question"], source_documents, qa_chain)
+        return {
+            "answer": result["answer"],
+            "sources": [
+                _document_source(doc)
+                for doc in result["source_documents"]
+            ],
+            "usage": {
+                "prompt_tokens": cb.prompt_tokens,
+                "completion_tokens": cb.completion_tokens,
+                "total_tokens": cb.total_tokens
+            },
+            "error": None
+        }
+
+    return _run_pipeline(questions_path, JsonlWriter(output), embed_batch, answer_one, workers, batch_size)
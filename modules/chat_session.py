@@ -0,0 +1,208 @@
+import tiktoken
+from typing import List, Dict, Any, Optional, Callable
+from modules.embedder import get_embedding
+from modules.retriever import cosine_similarity
+from modules.qa_chain_new import SYSTEM_PROMPT, GROUNDING_RULE, STYLE_RULE, usage_from_response
+
+# 固定不变的系统提示放在消息最前面，每轮请求的前缀完全一致，可以命中服务端的prompt缓存
+CHAT_SYSTEM_PROMPT = f"""{SYSTEM_PROMPT}
+每轮对话中，最后一条用户消息会附带从知识库检索到的上下文信息，请结合之前的对话回答。
+{GROUNDING_RULE}
+{STYLE_RULE}"""
+
+CONDENSE_PROMPT = """请根据下面的对话，把用户的追问改写成一个不依赖上下文、可以单独用于检索的完整问题。
+只输出改写后的问题，不要回答。
+
+{conversation}
+
+追问: {question}
+独立问题:"""
+
+SUMMARIZE_PROMPT = """请把下面的对话要点合并进已有摘要，保留事实、结论和用户关心的主题，输出更新后的摘要，不超过{max_words}字。
+
+已有摘要:
+{summary}
+
+新的对话:
+{conversation}
+
+更新后的摘要:"""
+
+_encoding = None
+
+def count_tokens(text: str) -> int:
+    """
+    使用tiktoken统计文本的token数量，编码文件无法加载（如离线环境）时按字符数估算
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        except Exception as e:
+            print(f"加载tiktoken编码失败，改为按字符数估算token: {str(e)}")
+            _encoding = False
+    if _encoding is False:
+        # 中文大约一个字一个token，按字符数估算偏保守
+        return len(text)
+    return len(_encoding.encode(text))
+
+def _format_turns(turns: List[Dict[str, str]]) -> str:
+    names = {"user": "用户", "assistant": "助手"}
+    return "\n".join(f"{names[turn['role']]}: {turn['content']}" for turn in turns)
+
+class ChatSession:
+    """
+    多轮对话会话
+
+    - 最近的对话原文保留在history中，超出max_history_tokens时，最早的一轮问答会被增量合并进摘要
+    - 追问先改写为独立问题再检索；改写后的问题与上一轮足够相似时直接复用上一轮的检索结果
+    - 消息顺序为：固定系统提示 → 对话摘要 → 最近对话 → 本轮上下文与问题，保证静态前缀稳定
+    """
+
+    def __init__(self, client, max_history_tokens: int = 1500, summary_max_words: int = 300,
+                 reuse_threshold: float = 0.9, model: str = "gpt-3.5-turbo"):
+        """
+        Args:
+            client: OpenAI客户端
+            max_history_tokens (int): 最近对话原文的token上限
+            summary_max_words (int): 对话摘要的字数上限
+            reuse_threshold (float): 独立问题与上一轮的余弦相似度达到该值时复用检索结果
+            model (str): 使用的聊天模型
+        """
+        self.client = client
+        self.max_history_tokens = max_history_tokens
+        self.summary_max_words = summary_max_words
+        self.reuse_threshold = reuse_threshold
+        self.model = model
+        self.summary = ""
+        self.history: List[Dict[str, str]] = []
+        self.last_query_embedding: Optional[List[float]] = None
+        self.last_chunks: List[str] = []
+
+    def reset(self) -> None:
+        """
+        清空对话历史、摘要和缓存的检索结果
+        """
+        self.summary = ""
+        self.history = []
+        self.last_query_embedding = None
+        self.last_chunks = []
+
+    def _complete(self, messages: List[Dict[str, str]], max_tokens: int, usage: Dict[str, int],
+                  temperature: float = 0.3) -> str:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        for key, value in (usage_from_response(response) or {}).items():
+            usage[key] = usage.get(key, 0) + value
+        return response.choices[0].message.content.strip()
+
+    def _condense_question(self, question: str, usage: Dict[str, int]) -> str:
+        """
+        结合摘要和最近对话，把追问改写为独立问题；没有历史时原样返回
+        """
+        if not self.history and not self.summary:
+            return question
+
+        conversation = _format_turns(self.history)
+        if self.summary:
+            conversation = f"对话摘要: {self.summary}\n{conversation}"
+        prompt = CONDENSE_PROMPT.format(conversation=conversation, question=question)
+
+        return self._complete([{"role": "user", "content": prompt}], max_tokens=200, usage=usage,
+                              temperature=0) or question
+
+    def _compact_history(self, usage: Dict[str, int]) -> None:
+        """
+        历史超出token预算时，把最早的问答轮次增量合并进摘要
+        """
+        folded = []
+        while self.history and count_tokens(_format_turns(self.history)) > self.max_history_tokens:
+            # 每次移出一问一答，保持history以用户消息开头
+            folded.extend(self.history[:2])
+            self.history = self.history[2:]
+
+        if not folded:
+            return
+
+        prompt = SUMMARIZE_PROMPT.format(
+            max_words=self.summary_max_words,
+            summary=self.summary or "（无）",
+            conversation=_format_turns(folded)
+        )
+        self.summary = self._complete([{"role": "user", "content": prompt}], max_tokens=600, usage=usage,
+                                      temperature=0)
+
+    def build_messages(self, question: str, context_chunks: List[str]) -> List[Dict[str, str]]:
+        """
+        按 静态前缀 → 摘要 → 最近对话 → 本轮上下文与问题 的顺序构造消息列表
+        """
+        messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"之前对话的摘要:\n{self.summary}"})
+        messages.extend(self.history)
+
+        context = "\n\n".join(context_chunks)
+        messages.append({"role": "user", "content": f"上下文信息:\n{context}\n\n用户问题: {question}"})
+        return messages
+
+    def ask(self, question: str, retrieve_fn: Callable[[List[float]], List[str]]) -> Dict[str, Any]:
+        """
+        进行一轮对话
+
+        Args:
+            question (str): 用户本轮输入
+            retrieve_fn: 根据查询向量返回相关文本块列表的函数
+
+        Returns:
+            Dict: 包含answer、standalone_question、chunks、reused_context、usage和error的字典
+        """
+        usage: Dict[str, int] = {}
+        try:
+            standalone = self._condense_question(question, usage)
+
+            # 话题没有变化时复用上一轮的检索结果
+            query_embedding = get_embedding(standalone)
+            reused = (
+                self.last_query_embedding is not None
+                and cosine_similarity(query_embedding, self.last_query_embedding) >= self.reuse_threshold
+            )
+            chunks = self.last_chunks if reused else retrieve_fn(query_embedding)
+
+            answer = self._complete(self.build_messages(question, chunks), max_tokens=800, usage=usage)
+        except Exception as e:
+            error_msg = str(e)
+            print(f"生成回答时出错: {error_msg}")
+            return {
+                "answer": f"生成回答时出错: {error_msg}",
+                "standalone_question": question,
+                "chunks": [],
+                "reused_context": False,
+                "usage": usage,
+                "error": error_msg
+            }
+
+        if not reused:
+            self.last_query_embedding = query_embedding
+            self.last_chunks = chunks
+
+        # 历史中只保存用户原话和回答，检索到的上下文不进入历史，避免历史随轮数快速膨胀
+        self.history.append({"role": "user", "content": question})
+        self.history.append({"role": "assistant", "content": answer})
+        try:
+            self._compact_history(usage)
+        except Exception as e:
+            # 摘要失败不影响本轮回答，直接丢弃超出预算的旧对话
+            print(f"压缩对话历史时出错: {str(e)}")
+
+        return {
+            "answer": answer,
+            "standalone_question": standalone,
+            "chunks": chunks,
+            "reused_context": reused,
+            "usage": usage,
+            "error": None
+        }
@@ -0,0 +1,188 @@
+import hashlib
+import re
+import zlib
+from functools import lru_cache
+import numpy as np
+from typing import List, Dict, Any, Callable, Optional
+
+# 大于2^32的素数，作为MinHash置换 (a * h + b) mod P 的模数
+_MINHASH_PRIME = np.uint64(4294967311)
+
+def normalize_text(text: str) -> str:
+    """
+    归一化文本：合并空白并转为小写，使仅有排版差异的文本块视为相同
+    """
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+def _shingles(text: str, size: int) -> np.ndarray:
+    """
+    提取字符级k-gram并哈希为32位整数（字符级对中文等不分词的文本同样适用）
+    """
+    if len(text) <= size:
+        grams = {text}
+    else:
+        grams = {text[i:i + size] for i in range(len(text) - size + 1)}
+    return np.array([zlib.crc32(gram.encode('utf-8')) for gram in grams], dtype=np.uint64)
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm: int, seed: int):
+    rng = np.random.RandomState(seed)
+    # a < 2^31 保证 a * h（h < 2^32）不会溢出uint64
+    a = rng.randint(1, 2 ** 31, size=num_perm).astype(np.uint64)
+    b = rng.randint(0, 2 ** 31, size=num_perm).astype(np.uint64)
+    return a, b
+
+def minhash_signature(text: str, num_perm: int = 64, shingle_size: int = 5, seed: int = 1) -> np.ndarray:
+    """
+    计算文本的MinHash签名，两段文本签名中相同位置相等的比例近似于它们k-gram集合的Jaccard相似度
+
+    Args:
+        text (str): 已归一化的文本
+        num_perm (int): 哈希置换数量（签名长度）
+        shingle_size (int): k-gram长度
+        seed (int): 随机种子，同一批比较必须一致
+
+    Returns:
+        np.ndarray: 长度为num_perm的签名
+    """
+    a, b = _permutations(num_perm, seed)
+    hashes = _shingles(text, shingle_size)
+    return ((np.outer(hashes, a) + b) % _MINHASH_PRIME).min(axis=0)
+
+def find_duplicate_groups(texts: List[str], threshold: float = 0.8, num_perm: int = 64,
+                          bands: int = 16, shingle_size: int = 5) -> List[List[int]]:
+    """
+    将完全相同或高度相似的文本分组
+
+    先用内容哈希合并完全相同的文本，再对剩余的不同文本计算MinHash。按原始顺序处理，
+    LSH桶中只登记各组的代表，每个文本只与同桶的代表比较，并入估计相似度最高且达到
+    threshold的组，否则成为新组的代表。因此组内每个文本都与代表相似，不会出现
+    A~B、B~C 但 A 与 C 不相似却被合并的链式分组。
+
+    Args:
+        texts (List[str]): 文本列表
+        threshold (float): 判定为近似重复的Jaccard相似度阈值
+        num_perm (int): MinHash签名长度，需能被bands整除
+        bands (int): LSH分段数量，越多召回越高、候选对越多
+        shingle_size (int): k-gram长度
+
+    Returns:
+        List[List[int]]: 覆盖所有文本的分组，组内和组间均按原始顺序排列，每组第一个为代表
+    """
+    if num_perm % bands != 0:
+        raise ValueError("num_perm必须能被bands整除")
+
+    # 第一步：内容哈希合并完全相同的文本
+    exact_groups: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        digest = hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+        exact_groups.setdefault(digest, []).append(i)
+    unique = list(exact_groups.values())
+
+    # 第二步：对不同的文本做MinHash + LSH，桶中只登记各组代表
+    rows = num_perm // bands
+    buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+    signatures: List[np.ndarray] = []
+    groups: List[List[int]] = []
+    for members in unique:
+        signature = minhash_signature(normalize_text(texts[members[0]]), num_perm=num_perm, shingle_size=shingle_size)
+        keys = [signature[band * rows:(band + 1) * rows].tobytes() for band in range(bands)]
+
+        candidates = sorted({g for band, key in enumerate(keys) for g in buckets[band].get(key, ())})
+        best = None
+        if candidates:
+            similarities = np.mean(np.stack([signatures[g] for g in candidates]) == signature, axis=1)
+            position = int(np.argmax(similarities))
+            if similarities[position] >= threshold:
+                best = candidates[position]
+
+        if best is None:
+            # 成为新组的代表
+            for band, key in enumerate(keys):
+                buckets[band].setdefault(key, []).append(len(groups))
+            signatures.append(signature)
+            groups.append(list(members))
+        else:
+            groups[best].extend(members)
+
+    return sorted((sorted(members) for members in groups), key=lambda members: members[0])
+
+def _provenance(record: Dict[str, Any], position: int) -> Dict[str, Any]:
+    source = {"position": position}
+    for key in ("file", "section_path"):
+        if key in record:
+            source[key] = record[key]
+    return source
+
+def _document_provenance(document: Any, position: int) -> Dict[str, Any]:
+    source = {"position": position}
+    if "source" in document.metadata:
+        source["source"] = document.metadata["source"]
+    return source
+
+def deduplicate_chunks(chunks: List[Dict[str, Any]], threshold: float = 0.8,
+                       partition: Optional[Callable[[Dict[str, Any]], Any]] = None, **kwargs) -> List[Dict[str, Any]]:
+    """
+    在切分与向量化之间去重：每组只保留第一个文本块作为代表
+
+    代表文本块会增加duplicates字段，记录同组其他文本块在去重前的序号（position）、
+    文件和章节，便于检索命中时追溯所有出处。
+
+    Args:
+        chunks (List[Dict]): 文本块记录，至少包含text
+        threshold (float): 近似重复的Jaccard相似度阈值
+        partition: 可选的分区函数，只在分区键相同的文本块之间去重（如按分片）
+        **kwargs: 传给find_duplicate_groups的其他参数
+
+    Returns:
+        List[Dict]: 代表文本块列表，按代表在原列表中的顺序排列
+    """
+    if partition is None:
+        partitions = [list(range(len(chunks)))]
+    else:
+        members_by_key: Dict[Any, List[int]] = {}
+        for i, chunk in enumerate(chunks):
+            members_by_key.setdefault(partition(chunk), []).append(i)
+        partitions = list(members_by_key.values())
+
+    groups = []
+    for indices in partitions:
+        local_groups = find_duplicate_groups([chunks[i]["text"] for i in indices], threshold=threshold, **kwargs)
+        groups.extend([indices[i] for i in members] for members in local_groups)
+    groups.sort(key=lambda members: members[0])
+
+    representatives = []
+    for members in groups:
+        representative = dict(chunks[members[0]])
+        if len(members) > 1:
+            representative["duplicates"] = [_provenance(chunks[i], i) for i in members[1:]]
+        representatives.append(representative)
+
+    return representatives
+
+def deduplicate_documents(documents: List[Any], threshold: float = 0.8, **kwargs) -> List[Any]:
+    """
+    对LangChain文档块去重，不修改传入的文档
+
+    代表文档为原文档的副本，其metadata的duplicates字段记录同组其他文档的序号（position）
+    和来源（source）。
+
+    Args:
+        documents (List): LangChain文档块列表
+        threshold (float): 近似重复的Jaccard相似度阈值
+        **kwargs: 传给find_duplicate_groups的其他参数
+
+    Returns:
+        List: 代表文档块列表
+    """
+    groups = find_duplicate_groups([doc.page_content for doc in documents], threshold=threshold, **kwargs)
+
+    representatives = []
+    for members in groups:
+        document = documents[members[0]]
+        metadata = dict(document.metadata)
+        if len(members) > 1:
+            metadata["duplicates"] = [_document_provenance(documents[i], i) for i in members[1:]]
+        representatives.append(type(document)(page_content=document.page_content, metadata=metadata))
+
+    return representatives
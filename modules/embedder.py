@@ -72,4 +72,43 @@ def get_embedding(text: str) -> List[float]:
         print(f"获取embedding时出错: {str(e)}")
         # 在出错时返回零向量，避免程序崩溃
         # 在实际应用中，您可能希望以更好的方式处理这种错误
-        return [0.0] * 1536  # text-embedding-ada-002 模型的维度是1536
\ No newline at end of file
+        return [0.0] * 1536  # text-embedding-ada-002 模型的维度是1536
+
+def get_embeddings(texts: List[str], batch_size: int = 100) -> List[List[float]]:
+    """
+    批量获取多段文本的embedding向量，每批只发起一次API调用
+    
+    Args:
+        texts (List[str]): 需要转换为向量的文本列表
+        batch_size (int): 每次API调用包含的文本数量
+        
+    Returns:
+        List[List[float]]: 与输入顺序一致的embedding向量列表
+        
+    Raises:
+        ValueError: 如果API未初始化
+        RuntimeError: 如果某一批调用失败（不使用零向量代替，避免检索结果静默出错）
+    """
+    if not openai_client:
+        raise ValueError("OpenAI API尚未初始化，请先设置API Key")
+    
+    # 空文本与get_embedding保持一致的处理方式
+    texts = [text if text and not text.isspace() else "empty" for text in texts]
+    
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        try:
+            response = openai_client.embeddings.create(
+                model="text-embedding-ada-002",
+                input=batch
+            )
+            # 按index排序，保证与输入顺序一致
+            data = sorted(response.data, key=lambda item: item.index)
+            embeddings.extend(item.embedding for item in data)
+        except Exception as e:
+            raise RuntimeError(
+                f"批量获取embedding时出错（第{start + 1}-{start + len(batch)}条）: {str(e)}"
+            ) from e
+    
+    return embeddings
@@ -0,0 +1,215 @@
+import math
+import re
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+from modules.text_splitter import split_text
+from modules.retriever import normalize_embeddings, top_k_indices
+
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*)$')
+
+def split_sections(text: str) -> List[Dict[str, Any]]:
+    """
+    按Markdown标题（load_markdown保留的 # 前缀）将文本切分为章节
+
+    load_markdown会将代码块内容缩进输出，代码中的 # 注释不会被当作标题。
+
+    Args:
+        text (str): load_markdown输出的纯文本
+
+    Returns:
+        List[Dict]: 章节列表，每项包含path（标题路径列表）和text（含标题行的章节文本）
+    """
+    sections = []
+    path: List[str] = []
+    lines: List[str] = []
+
+    def flush():
+        if any(line.strip() for line in lines):
+            sections.append({"path": list(path), "text": "\n".join(lines).strip()})
+
+    for line in text.split('\n'):
+        match = HEADING_PATTERN.match(line)
+        if match:
+            flush()
+            lines = []
+            level = len(match.group(1))
+            # 同级或更高级标题会结束之前的子章节
+            path = path[:level - 1] + [match.group(2).strip()]
+        lines.append(line)
+    flush()
+
+    return sections
+
+def build_section_chunks(text: str, source: str, chunk_size: int = 500, overlap: int = 50) -> List[Dict[str, Any]]:
+    """
+    在每个章节内部切分文本块，使文本块不跨越章节，并记录所属文件与标题路径
+
+    Args:
+        text (str): load_markdown输出的纯文本
+        source (str): 文件名或路径
+        chunk_size (int): 每个文本块的大小（字符数）
+        overlap (int): 相邻块之间的重叠字符数
+
+    Returns:
+        List[Dict]: 文本块列表，每项包含text、file和section_path
+    """
+    chunks = []
+    for section in split_sections(text):
+        for chunk in split_text(section["text"], chunk_size=chunk_size, overlap=overlap):
+            chunks.append({"text": chunk, "file": source, "section_path": section["path"]})
+
+    return chunks
+
+def format_section_path(path: List[str]) -> str:
+    """
+    将标题路径格式化为便于展示的字符串
+    """
+    return " > ".join(path) if path else "（无标题）"
+
+def _centroids(matrix: np.ndarray, groups: List[np.ndarray]) -> np.ndarray:
+    """
+    计算每组行向量的质心并归一化
+    """
+    return normalize_embeddings(np.stack([matrix[group].mean(axis=0) for group in groups]))
+
+def _masked_top_k(queries: np.ndarray, matrix: np.ndarray, candidates: Optional[List[np.ndarray]],
+                  top_k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    每个查询只在各自的候选行中取top_k
+
+    所有查询的候选行取并集后只做一次矩阵乘法，不属于某个查询候选的分数置为-inf；
+    candidates为None时所有行都是候选，直接与整个矩阵相乘，不复制矩阵。
+
+    Returns:
+        List: 每个查询的 (行号数组, 分数数组)，按分数从高到低排列
+    """
+    if candidates is None:
+        scores = queries @ matrix.T
+        return [(row, scores[q, row]) for q, row in enumerate(top_k_indices(scores, top_k))]
+
+    rows = np.unique(np.concatenate(candidates))
+    scores = queries @ matrix[rows].T
+    masked = np.full_like(scores, -np.inf)
+    for q, members in enumerate(candidates):
+        positions = np.searchsorted(rows, members)
+        masked[q, positions] = scores[q, positions]
+
+    results = []
+    for q, order in enumerate(top_k_indices(masked, top_k)):
+        # 候选数少于top_k时去掉补位的-inf
+        order = order[np.isfinite(masked[q, order])]
+        results.append((rows[order], masked[q, order]))
+    return results
+
+class HierarchicalIndex:
+    """
+    文件 → 章节 → 文本块 三层向量索引
+
+    文件和章节各自以其下文本块向量的质心作为代表向量。查询时先选出最相关的文件（默认按文件数量
+    自动确定保留数量），再在其中选出章节，最后只对这些章节内的文本块打分，被打分的向量数量远小于文本块总数。
+    """
+
+    def __init__(self, chunks: List[Dict[str, Any]], embeddings):
+        """
+        Args:
+            chunks: build_section_chunks输出的文本块列表（可来自多个文件）
+            embeddings: 与chunks一一对应的向量列表
+        """
+        if len(chunks) != len(embeddings):
+            raise ValueError("文本块数量与向量数量不一致")
+
+        self.chunks = chunks
+        self.chunk_matrix = normalize_embeddings(embeddings)
+
+        # 按 (文件, 标题路径) 对文本块分组，保持首次出现的顺序
+        section_ids: Dict[Any, int] = {}
+        section_members: List[List[int]] = []
+        self.section_keys = []
+        for i, chunk in enumerate(chunks):
+            key = (chunk["file"], tuple(chunk["section_path"]))
+            if key not in section_ids:
+                section_ids[key] = len(section_members)
+                section_members.append([])
+                self.section_keys.append(key)
+            section_members[section_ids[key]].append(i)
+        self.section_chunks = [np.array(members, dtype=np.int64) for members in section_members]
+
+        # 再按文件对章节分组
+        doc_ids: Dict[str, int] = {}
+        doc_members: List[List[int]] = []
+        self.doc_files = []
+        for section_id, (file, _) in enumerate(self.section_keys):
+            if file not in doc_ids:
+                doc_ids[file] = len(doc_members)
+                doc_members.append([])
+                self.doc_files.append(file)
+            doc_members[doc_ids[file]].append(section_id)
+        self.doc_sections = [np.array(members, dtype=np.int64) for members in doc_members]
+
+        if chunks:
+            self.section_matrix = _centroids(self.chunk_matrix, self.section_chunks)
+            self.doc_matrix = _centroids(
+                self.chunk_matrix,
+                [np.concatenate([self.section_chunks[s] for s in sections]) for sections in self.doc_sections]
+            )
+
+    def default_top_docs(self, top_sections: int) -> int:
+        """
+        未指定top_docs时按文件数量选择：保留约sqrt(文件数)个文件，且不少于top_sections个
+        """
+        return max(top_sections, int(math.ceil(math.sqrt(len(self.doc_files)))))
+
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = 3, top_sections: int = 3,
+                     top_docs: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        """
+        批量两阶段检索：先选文件和章节，再在选中章节内检索文本块，每一阶段整批查询只做一次矩阵乘法
+
+        Args:
+            query_embeddings (List[List[float]]): 查询向量列表
+            top_k (int): 每个查询返回的文本块数量
+            top_sections (int): 第一阶段保留的章节数量
+            top_docs (int, optional): 先保留的文件数量，为None时按文件数量自动选择（见default_top_docs），
+                为0时不按文件筛选，直接在所有章节中挑选
+
+        Returns:
+            List[List[Dict]]: 每个查询的命中结果，每项为文本块记录加上index和score
+        """
+        if not self.chunks or len(query_embeddings) == 0:
+            return [[] for _ in query_embeddings]
+
+        queries = normalize_embeddings(query_embeddings)
+        if top_docs is None:
+            top_docs = self.default_top_docs(top_sections)
+
+        # 第零阶段：挑选文件，候选章节为选中文件下的章节；保留全部文件时不筛选
+        candidate_sections = None
+        if 0 < top_docs < len(self.doc_files):
+            chosen_docs = top_k_indices(queries @ self.doc_matrix.T, top_docs)
+            candidate_sections = [np.concatenate([self.doc_sections[d] for d in row]) for row in chosen_docs]
+
+        # 第一阶段：挑选章节
+        chosen_sections = _masked_top_k(queries, self.section_matrix, candidate_sections, top_sections)
+
+        # 第二阶段：只对选中章节内的文本块打分
+        candidate_chunks = [
+            np.concatenate([self.section_chunks[s] for s in sections]) for sections, _ in chosen_sections
+        ]
+        results = []
+        for indices, scores in _masked_top_k(queries, self.chunk_matrix, candidate_chunks, top_k):
+            # 保留文本块记录中的全部字段（如去重时记录的duplicates）
+            results.append([
+                dict(self.chunks[index], index=int(index), score=float(score))
+                for index, score in zip(indices, scores)
+            ])
+
+        return results
+
+    def search(self, query_embedding: List[float], top_k: int = 3, top_sections: int = 3,
+               top_docs: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        两阶段检索单个查询，参数含义同search_batch
+
+        Returns:
+            List[Dict]: 命中结果，每项为文本块记录加上index和score
+        """
+        return self.search_batch([query_embedding], top_k=top_k, top_sections=top_sections, top_docs=top_docs)[0]
@@ -135,18 +135,19 @@ def get_chat_model(api_key: str, api_base: Optional[str] = None) -> ChatOpenAI:
             model="gpt-3.5-turbo"
         )
 
-def create_qa_chain(llm, vectorstore: FAISS) -> RetrievalQA:
+def create_qa_chain(llm, vectorstore: FAISS, top_k: int = 3) -> RetrievalQA:
     """
     创建问答检索链
     
     Args:
         llm: 语言模型实例
         vectorstore: 向量存储对象
+        top_k: 每次检索的文本块数量
         
     Returns:
         RetrievalQA: 问答检索链
     """
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+    retriever = vectorstore.as_retriever(search_kwargs={"k": top_k})
     
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
@@ -178,3 +179,25 @@ def query_knowledge_base(query: str, qa_chain) -> Dict[str, Any]:
         "answer": answer,
         "source_documents": source_documents
     }
+
+def answer_with_documents(query: str, source_documents: List[Any], qa_chain) -> Dict[str, Any]:
+    """
+    使用已检索好的文档调用问答链生成回答，跳过链内部的检索步骤
+    
+    Args:
+        query: 用户问题
+        source_documents: 已检索到的文档块列表
+        qa_chain: 问答检索链
+        
+    Returns:
+        Dict: 与query_knowledge_base格式一致的字典
+    """
+    answer = qa_chain.combine_documents_chain.run(
+        input_documents=source_documents,
+        question=query
+    )
+    
+    return {
+        "answer": answer,
+        "source_documents": source_documents
+    }
@@ -1,5 +1,16 @@
 import markdown
 import io
+import re
+
+# markdown输出的代码块：<pre><code ...>内容</code></pre>
+CODE_BLOCK_PATTERN = re.compile(r'<pre><code[^>]*>(.*?)</code></pre>', re.S)
+
+def _indent_code_block(match) -> str:
+    """
+    将代码块内容缩进4个空格输出，代码中以 # 开头的注释不会被当作标题
+    """
+    lines = match.group(1).split('\n')
+    return '\n' + '\n'.join('    ' + line for line in lines) + '\n'
 
 def load_markdown(file) -> str:
     """
@@ -20,11 +31,12 @@ def load_markdown(file) -> str:
             content = f.read()
     
     # 将Markdown转换为HTML（这一步是为了处理链接、强调等Markdown语法）
-    html = markdown.markdown(content)
+    # 启用fenced_code，否则 ``` 代码块中的 # 注释会被解析为标题
+    html = markdown.markdown(content, extensions=['markdown.extensions.fenced_code'])
     
     # 简单处理HTML标签，保留基本结构（如标题、段落）
     # 这里可以使用更复杂的HTML解析库如BeautifulSoup，但为简化依赖，我们用简单字符串处理
-    text = html
+    text = CODE_BLOCK_PATTERN.sub(_indent_code_block, html)
     
     # 替换常见HTML标签为纯文本格式
     replacements = [
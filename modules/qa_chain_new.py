@@ -1,58 +1,101 @@
 import openai
-from typing import List
+from typing import List, Dict, Any, Optional
 import streamlit as st
 from modules.embedder import api_base
 
-def generate_answer(question: str, context_chunks: List[str]) -> str:
+SYSTEM_PROMPT = "你是一个智能知识库助手，根据提供的上下文回答用户问题。"
+GROUNDING_RULE = '如果上下文中没有足够的信息回答问题，请直接说明"基于提供的信息，我无法回答这个问题"，不要编造答案。'
+STYLE_RULE = "请提供详细、准确的回答，并尽可能使用上下文中的原文表述。回答应该保持专业、友好的语气，并直接针对问题给出信息。"
+
+def usage_from_response(response) -> Optional[Dict[str, int]]:
     """
-    基于上下文生成问题的答案
-    
+    从chat completion响应中提取token用量，响应不含用量时返回None
+    """
+    if not response.usage:
+        return None
+    return {
+        "prompt_tokens": response.usage.prompt_tokens,
+        "completion_tokens": response.usage.completion_tokens,
+        "total_tokens": response.usage.total_tokens
+    }
+
+def build_prompt(question: str, context_chunks: List[str]) -> str:
+    """
+    根据问题和上下文构造发送给模型的prompt
+
     Args:
         question (str): 用户的问题
         context_chunks (List[str]): 相关的文本块列表
-        
+
     Returns:
-        str: 生成的答案
+        str: 构造好的prompt
     """
-    # 检查OpenAI客户端是否可用
-    openai_client = st.session_state.get("openai_client", None)
-    if not openai_client:
-        return "错误: OpenAI API 客户端未初始化，请先设置API Key"
-    
     # 合并上下文
     context = "\n\n".join(context_chunks)
-    
-    # 构造prompt
-    prompt = f"""
+
+    return f"""
 你是一个基于知识库的智能助手。请基于我提供的上下文信息，回答用户的问题。
-如果上下文中没有足够的信息回答问题，请直接说明"基于提供的信息，我无法回答这个问题"，不要编造答案。
+{GROUNDING_RULE}
 
 上下文信息:
 {context}
 
 用户问题: {question}
 
-请提供详细、准确的回答，并尽可能使用上下文中的原文表述。回答应该保持专业、友好的语气，并直接针对问题给出信息。
+{STYLE_RULE}
 """
 
+def generate_answer_with_usage(question: str, context_chunks: List[str], client=None) -> Dict[str, Any]:
+    """
+    基于上下文生成问题的答案，并返回本次调用的token用量
+
+    Args:
+        question (str): 用户的问题
+        context_chunks (List[str]): 相关的文本块列表
+        client: 可选的OpenAI客户端，未提供时使用st.session_state中的客户端
+
+    Returns:
+        Dict: 包含answer、usage和error的字典，出错时usage为None
+    """
+    # 检查OpenAI客户端是否可用
+    openai_client = client or st.session_state.get("openai_client", None)
+    if not openai_client:
+        error_msg = "OpenAI API 客户端未初始化，请先设置API Key"
+        return {"answer": f"错误: {error_msg}", "usage": None, "error": error_msg}
+
+    prompt = build_prompt(question, context_chunks)
+
     try:
-        # 使用st.session_state中的 openai_client
         response = openai_client.chat.completions.create(
             model="gpt-3.5-turbo",  # 可以根据需求更换模型
             messages=[
-                {"role": "system", "content": "你是一个智能知识库助手，根据提供的上下文回答用户问题。"},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.3,  # 降低温度以获得更确定的回答
             max_tokens=800  # 限制回答长度
         )
-        
-        # 提取生成的回答文本
+
+        # 提取生成的回答文本和token用量
         answer = response.choices[0].message.content
-        return answer
-        
+        return {"answer": answer, "usage": usage_from_response(response), "error": None}
+
     except Exception as e:
         # 发生错误时返回错误信息
         error_msg = str(e)
         print(f"生成回答时出错: {error_msg}")
-        return f"生成回答时出错: {error_msg}"
\ No newline at end of file
+        return {"answer": f"生成回答时出错: {error_msg}", "usage": None, "error": error_msg}
+
+def generate_answer(question: str, context_chunks: List[str], client=None) -> str:
+    """
+    基于上下文生成问题的答案
+
+    Args:
+        question (str): 用户的问题
+        context_chunks (List[str]): 相关的文本块列表
+        client: 可选的OpenAI客户端，未提供时使用st.session_state中的客户端
+
+    Returns:
+        str: 生成的答案
+    """
+    return generate_answer_with_usage(question, context_chunks, client=client)["answer"]
\ No newline at end of file
@@ -44,15 +44,80 @@ def retrieve(query_embedding: List[float], doc_embeddings: List[List[float]], to
         List[int]: 最相似的文档索引列表
     """
     # 如果文档向量为空，返回空列表
-    if not doc_embeddings:
+    if len(doc_embeddings) == 0:
         return []
     
-    # 计算查询向量与所有文档向量的相似度
-    similarities = [cosine_similarity(query_embedding, doc_embedding) 
-                   for doc_embedding in doc_embeddings]
+    # 单个查询即批量检索的特例，统一走矩阵运算
+    return retrieve_batch([query_embedding], doc_embeddings, top_k=top_k)[0]
+
+def normalize_embeddings(embeddings) -> np.ndarray:
+    """
+    将向量列表转换为按行L2归一化的矩阵，零向量保持为零
+    
+    Args:
+        embeddings: 向量列表或二维数组
+        
+    Returns:
+        np.ndarray: 归一化后的二维矩阵
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # 防止除以零：零向量的相似度统一为0
+    norms[norms == 0] = 1.0
+    
+    return matrix / norms
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    对相似度矩阵的每一行取分数最高的top_k个列索引（从大到小排列）
+    
+    Args:
+        scores (np.ndarray): 形状为 (查询数, 文档数) 的相似度矩阵
+        top_k (int): 每行返回的索引数量
+        
+    Returns:
+        np.ndarray: 形状为 (查询数, k) 的索引矩阵
+    """
+    k = min(top_k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    
+    # 先用argpartition取出候选，再只对候选排序，避免对整行全排序
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    
+    return np.take_along_axis(candidates, order, axis=1)
+
+def retrieve_batch(query_embeddings: List[List[float]], doc_embeddings, top_k: int = 3,
+                   normalized: bool = False) -> List[List[int]]:
+    """
+    批量检索：一次矩阵乘法计算所有查询与所有文档的余弦相似度
+    
+    Args:
+        query_embeddings (List[List[float]]): 查询向量列表
+        doc_embeddings: 文档向量列表，或已由normalize_embeddings归一化的矩阵
+        top_k (int): 每个查询返回的最相似文档数量
+        normalized (bool): doc_embeddings是否已归一化，为True时只归一化查询向量
+        
+    Returns:
+        List[List[int]]: 每个查询对应的最相似文档索引列表
+    """
+    if len(query_embeddings) == 0:
+        return []
+    if len(doc_embeddings) == 0:
+        return [[] for _ in query_embeddings]
+    
+    queries = normalize_embeddings(query_embeddings)
+    docs = doc_embeddings if normalized else normalize_embeddings(doc_embeddings)
     
-    # 获取相似度排序后的索引
-    sorted_indices = np.argsort(similarities)[::-1]  # 从大到小排序
+    # (查询数, 维度) x (维度, 文档数) -> (查询数, 文档数)
+    similarities = queries @ docs.T
     
-    # 返回top_k个最相似的文档索引
-    return sorted_indices[:min(top_k, len(sorted_indices))].tolist()
+    return top_k_indices(similarities, top_k).tolist()
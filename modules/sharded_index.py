@@ -0,0 +1,420 @@
+import json
+import os
+import threading
+import zlib
+import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+from typing import List, Dict, Any, Tuple, Optional
+from modules.retriever import normalize_embeddings, top_k_indices
+
+MANIFEST_FILE = "manifest.json"
+# 分片服务等待客户端完成认证握手的最长时间（秒）
+HANDSHAKE_TIMEOUT = 10.0
+
+def source_root(paths: List[str]) -> str:
+    """
+    计算输入文件或目录的公共根目录（绝对路径），作为分片索引中文件路径的基准
+    """
+    if not paths:
+        return os.getcwd()
+    dirs = [path if os.path.isdir(path) else os.path.dirname(path) for path in paths]
+    return os.path.commonpath([os.path.abspath(path) for path in dirs])
+
+def normalize_source(path: str, root: Optional[str] = None) -> str:
+    """
+    将文件路径规范化为相对root的路径，使 notes/a.md 与 ./notes/a.md 等写法得到同一个值
+
+    Args:
+        path (str): 文件路径
+        root (str, optional): 基准目录，为None时只做normpath
+
+    Returns:
+        str: 以 / 分隔的规范化路径
+    """
+    if root is None:
+        normalized = os.path.normpath(path)
+    else:
+        normalized = os.path.relpath(os.path.abspath(path), root)
+    return normalized.replace(os.sep, "/")
+
+def shard_for(source: str, num_shards: int) -> int:
+    """
+    按文件计算所属分片，同一文件的所有文本块总在同一分片中
+
+    source应为normalize_source的结果；使用crc32而不是hash()，保证跨进程、跨机器结果稳定。
+    """
+    return zlib.crc32(source.encode('utf-8')) % num_shards
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """
+    解析 HOST:PORT 形式的分片服务地址，省略HOST时为localhost
+    """
+    host, _, port = address.rpartition(":")
+    return host or "localhost", int(port)
+
+def _shard_path(directory: str, shard_id: int) -> str:
+    return os.path.join(directory, f"shard_{shard_id:03d}.npz")
+
+def save_shard(directory: str, shard_id: int, chunks: List[Dict[str, Any]], embeddings) -> None:
+    """
+    将一个分片的文本块与归一化后的向量写入磁盘
+
+    Args:
+        directory (str): 索引目录
+        shard_id (int): 分片编号
+        chunks (List[Dict]): 文本块记录，至少包含text和file
+        embeddings: 与chunks一一对应的向量列表
+    """
+    path = _shard_path(directory, shard_id)
+    matrix = normalize_embeddings(embeddings) if len(chunks) else np.empty((0, 0), dtype=np.float32)
+
+    # 向量与文本块记录写入同一个文件，先写临时文件再一次替换，
+    # 重建分片时正在加载的进程只会读到完整的旧分片或完整的新分片
+    with open(path + ".tmp", 'wb') as f:
+        np.savez(f, matrix=matrix, records=np.array(json.dumps(chunks, ensure_ascii=False)))
+    os.replace(path + ".tmp", path)
+
+def load_shard(directory: str, shard_id: int) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """
+    从磁盘加载一个分片
+
+    Returns:
+        Tuple: (文本块记录列表, 归一化向量矩阵)
+
+    Raises:
+        ValueError: 如果向量行数与文本块数量不一致
+    """
+    with np.load(_shard_path(directory, shard_id)) as data:
+        matrix = data["matrix"]
+        chunks = json.loads(str(data["records"]))
+
+    if len(chunks) != matrix.shape[0]:
+        raise ValueError(f"分片 {shard_id} 损坏：向量 {matrix.shape[0]} 行，文本块 {len(chunks)} 个")
+    return chunks, matrix
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    """
+    读取索引目录的清单文件，目录中没有索引时返回None
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def build_sharded_index(directory: str, chunks: List[Dict[str, Any]], embeddings, num_shards: int = 4,
+                        root: Optional[str] = None) -> None:
+    """
+    按文件将文本块划分到num_shards个分片并写入索引目录
+
+    Args:
+        directory (str): 索引目录，不存在时自动创建
+        chunks (List[Dict]): 文本块记录，至少包含text和file（file为相对root的规范化路径）
+        embeddings: 与chunks一一对应的向量列表
+        num_shards (int): 分片数量
+        root (str, optional): 文件路径的基准目录，记录在清单中供单独重建分片时使用
+    """
+    if num_shards < 1:
+        raise ValueError("分片数量必须大于0")
+
+    os.makedirs(directory, exist_ok=True)
+    members: List[List[int]] = [[] for _ in range(num_shards)]
+    for i, chunk in enumerate(chunks):
+        members[shard_for(chunk["file"], num_shards)].append(i)
+
+    for shard_id, indices in enumerate(members):
+        save_shard(directory, shard_id, [chunks[i] for i in indices], [embeddings[i] for i in indices])
+
+    with open(os.path.join(directory, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"num_shards": num_shards, "root": root}, f, ensure_ascii=False)
+
+def rebuild_shard(directory: str, shard_id: int, chunks: List[Dict[str, Any]], embeddings) -> None:
+    """
+    单独重建一个分片，其他分片保持不变
+
+    chunks中不属于该分片的文本块会被忽略，因此调用方可以只对
+    shard_for(file, num_shards) == shard_id 的文件重新切分和向量化。
+
+    Args:
+        directory (str): 已有的索引目录
+        shard_id (int): 要重建的分片编号
+        chunks (List[Dict]): 文本块记录
+        embeddings: 与chunks一一对应的向量列表
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise ValueError(f"{directory} 中没有分片索引")
+    if not 0 <= shard_id < manifest["num_shards"]:
+        raise ValueError(f"分片编号超出范围: {shard_id}")
+
+    indices = [i for i, chunk in enumerate(chunks) if shard_for(chunk["file"], manifest["num_shards"]) == shard_id]
+    save_shard(directory, shard_id, [chunks[i] for i in indices], [embeddings[i] for i in indices])
+
+def search_shard(chunks: List[Dict[str, Any]], matrix: np.ndarray, queries: np.ndarray,
+                 top_k: int) -> List[List[Tuple[float, Dict[str, Any]]]]:
+    """
+    在单个分片内对一批（已归一化的）查询做一次矩阵检索
+
+    Returns:
+        List: 每个查询对应的 (相似度, 文本块记录) 列表
+    """
+    if not chunks:
+        return [[] for _ in range(len(queries))]
+
+    scores = queries @ matrix.T
+    indices = top_k_indices(scores, top_k)
+    return [
+        [(float(scores[q, i]), chunks[i]) for i in row]
+        for q, row in enumerate(indices)
+    ]
+
+# 每个分片工作进程中常驻的分片数据
+_worker_shard = None
+
+def _init_worker(directory: str, shard_id: int) -> None:
+    global _worker_shard
+    _worker_shard = load_shard(directory, shard_id)
+
+def _search_worker(queries: np.ndarray, top_k: int):
+    chunks, matrix = _worker_shard
+    return search_shard(chunks, matrix, queries, top_k)
+
+class LocalShard:
+    """
+    本机分片：每个分片独占一个工作进程，分片数据只在该进程中加载一次
+    """
+
+    def __init__(self, directory: str, shard_id: int):
+        self.directory = directory
+        self.shard_id = shard_id
+        self._start()
+
+    def _start(self) -> None:
+        self.executor = ProcessPoolExecutor(
+            max_workers=1,
+            initializer=_init_worker,
+            initargs=(self.directory, self.shard_id)
+        )
+
+    def submit(self, queries: np.ndarray, top_k: int) -> Future:
+        return self.executor.submit(_search_worker, queries, top_k)
+
+    def reload(self) -> None:
+        """
+        分片在磁盘上重建后，重启工作进程以加载新数据
+        """
+        old = self.executor
+        self._start()
+        old.shutdown(wait=True)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+class RemoteShard:
+    """
+    远程分片：通过socket连接到serve_shard启动的分片服务
+    """
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes):
+        if not authkey:
+            raise ValueError("连接分片服务必须提供认证密钥")
+        self.address = address
+        self.authkey = authkey
+        # 单线程保证同一连接上的请求按顺序收发
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.conn = None
+
+    def _call(self, *message):
+        if self.conn is None:
+            self.conn = Client(self.address, authkey=self.authkey)
+        try:
+            self.conn.send(message)
+            status, payload = self.conn.recv()
+        except (EOFError, OSError):
+            # 连接已断开，下次请求时重新连接
+            self.conn.close()
+            self.conn = None
+            raise
+        if status != "ok":
+            raise RuntimeError(f"分片服务 {self.address[0]}:{self.address[1]} 返回错误: {payload}")
+        return payload
+
+    def submit(self, queries: np.ndarray, top_k: int) -> Future:
+        return self.executor.submit(self._call, "search", queries, top_k)
+
+    def reload(self) -> int:
+        """
+        通知分片服务从磁盘重新加载分片，返回加载后的文本块数量
+        """
+        return self.executor.submit(self._call, "reload").result()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        if self.conn is not None:
+            self.conn.close()
+
+class _HandshakeConnection:
+    """
+    认证握手期间使用的连接包装：每次接收前最多等待timeout秒，超时视为认证失败
+    """
+
+    def __init__(self, conn, timeout: float):
+        self.conn = conn
+        self.timeout = timeout
+
+    def send_bytes(self, buf) -> None:
+        self.conn.send_bytes(buf)
+
+    def recv_bytes(self, maxlength: Optional[int] = None) -> bytes:
+        if not self.conn.poll(self.timeout):
+            raise AuthenticationError("认证超时")
+        return self.conn.recv_bytes(maxlength)
+
+def serve_shard(directory: str, shard_id: int, address: Tuple[str, int], authkey: bytes) -> None:
+    """
+    启动一个分片服务进程，接受RemoteShard的检索请求（阻塞运行）
+
+    multiprocessing.connection会反序列化收到的数据，认证密钥是唯一的访问控制，
+    因此必须提供，且不要使用容易猜到的值。
+
+    Args:
+        directory (str): 索引目录
+        shard_id (int): 分片编号
+        address (Tuple[str, int]): 监听地址 (host, port)
+        authkey (bytes): 连接认证密钥
+    """
+    if not authkey:
+        raise ValueError("启动分片服务必须提供认证密钥")
+
+    # 分片数据整体替换，正在处理的检索请求仍使用替换前的数据
+    state = {"shard": load_shard(directory, shard_id)}
+    print(f"分片 {shard_id} 已加载 {len(state['shard'][0])} 个文本块，监听 {address[0]}:{address[1]}")
+
+    def handle(message) -> Tuple[str, Any]:
+        # 单个请求出错时把错误返回给客户端，不影响服务继续运行
+        try:
+            if message[0] == "search":
+                _, queries, top_k = message
+                chunks, matrix = state["shard"]
+                return "ok", search_shard(chunks, matrix, queries, top_k)
+            if message[0] == "reload":
+                state["shard"] = load_shard(directory, shard_id)
+                print(f"分片 {shard_id} 已重新加载 {len(state['shard'][0])} 个文本块")
+                return "ok", len(state["shard"][0])
+            return "error", f"未知请求: {message[0]!r}"
+        except Exception as e:
+            return "error", str(e)
+
+    def serve_connection(conn) -> None:
+        with conn:
+            # 认证握手在连接线程中进行，不响应的客户端不会阻塞接受其他连接
+            try:
+                handshake = _HandshakeConnection(conn, HANDSHAKE_TIMEOUT)
+                deliver_challenge(handshake, authkey)
+                answer_challenge(handshake, authkey)
+            except (EOFError, OSError, AuthenticationError) as e:
+                print(f"拒绝连接: {str(e)}")
+                return
+
+            try:
+                while True:
+                    conn.send(handle(conn.recv()))
+            except (EOFError, OSError):
+                # 客户端断开
+                pass
+            except Exception as e:
+                # 无法解析的数据等异常只关闭当前连接
+                print(f"连接异常，已断开: {str(e)}")
+
+    # Listener不做认证，accept只接受连接，认证由serve_connection完成
+    with Listener(address) as listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError as e:
+                print(f"接受连接失败: {str(e)}")
+                continue
+            # 每个连接一个线程，批量问答保持长连接时仍可以发送reload等请求
+            threading.Thread(target=serve_connection, args=(conn,), daemon=True).start()
+
+class ShardedIndex:
+    """
+    分片向量索引：查询并行分发到各分片（scatter），再合并各分片的top_k结果（gather）
+    """
+
+    def __init__(self, shards: List[Any]):
+        """
+        Args:
+            shards: 分片后端列表（LocalShard或RemoteShard）
+        """
+        self.shards = shards
+
+    @classmethod
+    def from_directory(cls, directory: str) -> "ShardedIndex":
+        """
+        为索引目录中的每个分片启动一个本机工作进程
+        """
+        manifest = read_manifest(directory)
+        if manifest is None:
+            raise ValueError(f"{directory} 中没有分片索引")
+        return cls([LocalShard(directory, shard_id) for shard_id in range(manifest["num_shards"])])
+
+    @classmethod
+    def connect(cls, addresses: List[Tuple[str, int]], authkey: bytes) -> "ShardedIndex":
+        """
+        连接到若干已启动的分片服务
+        """
+        return cls([RemoteShard(address, authkey) for address in addresses])
+
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        """
+        批量检索：每个分片对整批查询只做一次矩阵运算，结果按相似度合并
+
+        Args:
+            query_embeddings (List[List[float]]): 查询向量列表
+            top_k (int): 每个查询返回的文本块数量
+
+        Returns:
+            List[List[Dict]]: 每个查询的命中结果，每项为文本块记录加上score和shard
+        """
+        if len(query_embeddings) == 0:
+            return []
+
+        queries = normalize_embeddings(query_embeddings)
+        futures = [shard.submit(queries, top_k) for shard in self.shards]
+
+        merged: List[List[Tuple[float, int, Dict[str, Any]]]] = [[] for _ in range(len(queries))]
+        for shard_id, future in enumerate(futures):
+            for q, hits in enumerate(future.result()):
+                merged[q].extend((score, shard_id, chunk) for score, chunk in hits)
+
+        results = []
+        for hits in merged:
+            hits.sort(key=lambda hit: hit[0], reverse=True)
+            results.append([dict(chunk, score=score, shard=shard_id) for score, shard_id, chunk in hits[:top_k]])
+
+        return results
+
+    def search(self, query_embedding: List[float], top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        单个查询的检索，是search_batch的特例
+        """
+        return self.search_batch([query_embedding], top_k=top_k)[0]
+
+    def reload_shard(self, shard_id: int) -> None:
+        """
+        在rebuild_shard之后调用，只重新加载该分片
+        """
+        self.shards[shard_id].reload()
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+
+    def __enter__(self) -> "ShardedIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,132 @@
+import argparse
+import os
+import sys
+from typing import List
+from dotenv import load_dotenv
+from modules.batch_qa import collect_markdown_files
+from modules.sharded_index import (
+    RemoteShard, build_sharded_index, normalize_source, parse_address, rebuild_shard,
+    read_manifest, serve_shard, shard_for, source_root
+)
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="构建、重建和启动分片向量索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="切分并向量化文档，按文件写入分片索引")
+    build.add_argument("index_dir", help="分片索引目录")
+    build.add_argument("--docs", nargs="+", required=True, help="Markdown文件或目录（目录会递归查找.md文件）")
+    build.add_argument("--shards", type=int, default=4, help="分片数量（仅在新建索引时生效）")
+    build.add_argument("--only-shard", type=int, default=None,
+                       help="只重建指定分片，只会切分和向量化属于该分片的文件")
+    build.add_argument("--chunk-size", type=int, default=500, help="文本块大小")
+    build.add_argument("--chunk-overlap", type=int, default=50, help="文本块重叠度")
+    build.add_argument("--batch-size", type=int, default=64, help="每批向量化的文本数量")
+    build.add_argument("--no-dedup", action="store_true", help="不合并重复文本块（默认在向量化前合并）")
+    build.add_argument("--dedup-threshold", type=float, default=0.8, help="近似重复的Jaccard相似度阈值")
+    build.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY"), help="OpenAI API Key，默认读取OPENAI_API_KEY")
+    build.add_argument("--api-base", default=os.getenv("OPENAI_API_BASE"), help="自定义API地址，默认读取OPENAI_API_BASE")
+
+    serve = subparsers.add_parser("serve", help="启动单个分片的检索服务，供 batch_qa.py --shard-servers 连接")
+    serve.add_argument("index_dir", help="分片索引目录")
+    serve.add_argument("--shard", type=int, required=True, help="分片编号")
+    serve.add_argument("--host", default="localhost", help="监听地址")
+    serve.add_argument("--port", type=int, required=True, help="监听端口")
+    serve.add_argument("--authkey", default=os.getenv("MD_HELPER_SHARD_AUTHKEY"),
+                       help="认证密钥（必填），默认读取MD_HELPER_SHARD_AUTHKEY；请使用不易猜测的随机值")
+
+    reload = subparsers.add_parser("reload", help="通知正在运行的分片服务从磁盘重新加载分片（重建分片后使用）")
+    reload.add_argument("shard_servers", nargs="+", metavar="HOST:PORT", help="分片服务地址")
+    reload.add_argument("--authkey", default=os.getenv("MD_HELPER_SHARD_AUTHKEY"),
+                        help="认证密钥（必填），默认读取MD_HELPER_SHARD_AUTHKEY")
+
+    return parser.parse_args(argv)
+
+def build(args: argparse.Namespace) -> int:
+    from modules import embedder
+    from modules.markdown_loader import load_markdown
+    from modules.text_splitter import split_text
+    from modules.deduplicator import deduplicate_chunks
+
+    if not args.api_key:
+        print("请通过 --api-key 或环境变量 OPENAI_API_KEY 提供API Key", file=sys.stderr)
+        return 1
+
+    files = collect_markdown_files(args.docs)
+    num_shards = args.shards
+    root = source_root(args.docs)
+    if args.only_shard is not None:
+        manifest = read_manifest(args.index_dir)
+        if manifest is None:
+            print(f"{args.index_dir} 中没有分片索引，请先完整构建", file=sys.stderr)
+            return 1
+        # 按构建时记录的根目录规范化路径，只处理属于该分片的文件，其他分片无需重新向量化
+        num_shards = manifest["num_shards"]
+        root = manifest.get("root")
+        files = [path for path in files if shard_for(normalize_source(path, root), num_shards) == args.only_shard]
+
+    embedder.initialize_openai(args.api_key, args.api_base)
+    chunks = []
+    for path in files:
+        content = load_markdown(path)
+        source = normalize_source(path, root)
+        chunks.extend(
+            {"text": chunk, "file": source}
+            for chunk in split_text(content, chunk_size=args.chunk_size, overlap=args.chunk_overlap)
+        )
+    # 只在分片内部去重，单独重建某个分片时得到的结果与完整构建一致
+    if not args.no_dedup:
+        chunks = deduplicate_chunks(
+            chunks,
+            threshold=args.dedup_threshold,
+            partition=lambda chunk: shard_for(chunk["file"], num_shards)
+        )
+    try:
+        embeddings = embedder.get_embeddings([chunk["text"] for chunk in chunks], batch_size=args.batch_size)
+    except RuntimeError as e:
+        # 不写入部分失败的索引，已有分片保持不变
+        print(f"索引构建失败: {str(e)}", file=sys.stderr)
+        return 1
+
+    if args.only_shard is not None:
+        rebuild_shard(args.index_dir, args.only_shard, chunks, embeddings)
+        print(f"分片 {args.only_shard} 已重建，共 {len(chunks)} 个文本块", file=sys.stderr)
+        print("正在运行的分片服务不会自动加载新数据，请执行 shard_index.py reload 或重启服务", file=sys.stderr)
+    else:
+        build_sharded_index(args.index_dir, chunks, embeddings, num_shards=args.shards, root=root)
+        print(f"索引已构建：{len(chunks)} 个文本块，{args.shards} 个分片", file=sys.stderr)
+    return 0
+
+def reload(addresses: List[str], authkey: bytes) -> int:
+    failed = 0
+    for address in addresses:
+        shard = RemoteShard(parse_address(address), authkey)
+        try:
+            print(f"{address} 已重新加载 {shard.reload()} 个文本块", file=sys.stderr)
+        except Exception as e:
+            print(f"{address} 重新加载失败: {str(e)}", file=sys.stderr)
+            failed += 1
+        finally:
+            shard.close()
+    return 1 if failed else 0
+
+def main(argv=None) -> int:
+    load_dotenv()
+    args = parse_args(argv)
+
+    if args.command == "build":
+        return build(args)
+
+    if not args.authkey:
+        print("请通过 --authkey 或环境变量 MD_HELPER_SHARD_AUTHKEY 提供认证密钥", file=sys.stderr)
+        return 1
+    authkey = args.authkey.encode('utf-8')
+
+    if args.command == "reload":
+        return reload(args.shard_servers, authkey)
+
+    serve_shard(args.index_dir, args.shard, (args.host, args.port), authkey)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())